@@ -1,19 +1,20 @@
 # main.py
 from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel, Field
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
 from dotenv import load_dotenv
 import httpx
+from cachetools import TTLCache
+import asyncio
 import os
-import json
+import time
+import orjson
 from datetime import datetime, timezone
 from typing import Dict, Any, List, Optional, Tuple
 import logging
-import re
-from urllib.parse import urljoin
-import mimetypes
+from contextlib import asynccontextmanager
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
-app = FastAPI()
 
 # --------------------------------------------------------------------------- #
 #  Environment
@@ -27,6 +28,90 @@ DISCORD_WEBHOOK_URL = os.getenv(
 PLANE_BASE_URL = os.getenv("PLANE_BASE_URL", "").rstrip("/")
 PLANE_API_TOKEN = os.getenv("PLANE_API_TOKEN")
 
+
+# --------------------------------------------------------------------------- #
+#  App lifecycle – shared HTTP clients (keep‑alive connection pools)
+# --------------------------------------------------------------------------- #
+async def _stop_worker(
+    queue: asyncio.Queue, stop: object, task: asyncio.Task, timeout: float
+) -> int:
+    """
+    Send *stop* to a queue worker and give it *timeout* seconds to drain.
+
+    On timeout the worker is cancelled; returns the number of queued items
+    that were dropped.
+    """
+    async def drain() -> None:
+        await queue.put(stop)
+        await task
+
+    try:
+        await asyncio.wait_for(drain(), timeout=timeout)
+        return 0
+    except asyncio.TimeoutError:
+        dropped = 0
+        while not queue.empty():
+            if queue.get_nowait() is not stop:
+                dropped += 1
+        return dropped
+    except Exception as exc:
+        logging.error("Worker failed during shutdown: %s", exc)
+        return queue.qsize()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A single worker posts to Discord sequentially so messages stay in order.
+    # HTTP/2 is kept for cheap reuse of that one long-lived connection, not for
+    # multiplexing, so the pool only needs to be small.
+    app.state.discord_client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(20.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=2, max_connections=4, keepalive_expiry=60
+        ),
+    )
+    app.state.plane_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(10.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=20, max_connections=100, keepalive_expiry=30
+        ),
+    )
+    archive_task = None
+    if ARCHIVE_ENABLED:
+        app.state.archive_q = asyncio.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        archive_task = asyncio.create_task(_archive_worker(app.state.archive_q))
+    app.state.discord_q = asyncio.Queue(maxsize=DISCORD_QUEUE_SIZE)
+    discord_task = asyncio.create_task(
+        _discord_worker(app.state.discord_client, app.state.discord_q)
+    )
+    try:
+        yield
+    finally:
+        # deliver the backlog, but don't let a Discord outage stall shutdown
+        dropped = await _stop_worker(
+            app.state.discord_q, _DISCORD_STOP, discord_task, DISCORD_SHUTDOWN_TIMEOUT
+        )
+        if dropped:
+            logging.warning(
+                "Shutdown deadline reached, dropped %d queued Discord message(s)",
+                dropped,
+            )
+        if archive_task:
+            dropped = await _stop_worker(
+                app.state.archive_q, _ARCHIVE_STOP, archive_task, ARCHIVE_SHUTDOWN_TIMEOUT
+            )
+            if dropped:
+                logging.warning(
+                    "Shutdown deadline reached, dropped %d queued archive record(s)",
+                    dropped,
+                )
+        await app.state.discord_client.aclose()
+        await app.state.plane_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
 # --------------------------------------------------------------------------- #
 #  Models – accept anything Plane sends
 # --------------------------------------------------------------------------- #
@@ -50,16 +135,140 @@ class PlaneWebhook(BaseModel):
     activity: Optional[Activity] = None
 
 
+def _inline_schema_refs(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace local "#/$defs/..." references with their definitions so the
+    schema can be embedded in an OpenAPI path operation on its own.
+    """
+    defs = schema.pop("$defs", {})
+
+    def resolve(node: Any) -> Any:
+        if isinstance(node, list):
+            return [resolve(v) for v in node]
+        if not isinstance(node, dict):
+            return node
+        ref = node.get("$ref", "")
+        resolved = {k: resolve(v) for k, v in node.items() if k != "$ref"}
+        if ref.startswith("#/$defs/"):
+            return {**resolve(defs[ref[len("#/$defs/"):]]), **resolved}
+        if ref:
+            resolved["$ref"] = ref
+        return resolved
+
+    return resolve(schema)
+
+
+# the endpoint parses the body itself, so document it explicitly
+_PLANE_WEBHOOK_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": _inline_schema_refs(PlaneWebhook.model_json_schema())
+            }
+        },
+    }
+}
+
+
 # --------------------------------------------------------------------------- #
-#  Utility – archive every payload locally (comment‑out to disable)
+#  Utility – archive every payload locally (set ARCHIVE_REQUESTS=1 to enable)
 # --------------------------------------------------------------------------- #
-def save_plane_request(payload: Dict[str, Any]) -> None:
-    folder = "plane_requests"
-    os.makedirs(folder, exist_ok=True)
-    filename = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + ".json"
-    path = os.path.join(folder, filename)
-    with open(path, "w", encoding="utf-8") as fp:
-        json.dump(payload, fp, ensure_ascii=False, indent=2)
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_REQUESTS", "").lower() in ("1", "true", "yes")
+ARCHIVE_DIR = "plane_requests"
+ARCHIVE_QUEUE_SIZE = 10_000
+ARCHIVE_FLUSH_EVERY = 100      # records
+ARCHIVE_FLUSH_INTERVAL = 2.0   # seconds
+ARCHIVE_BUFFER_SIZE = 1 << 20  # large enough that writes between flushes stay in memory
+ARCHIVE_SHUTDOWN_TIMEOUT = 5.0  # seconds to write the backlog on shutdown
+_ARCHIVE_STOP = object()
+
+
+def save_plane_request(app: FastAPI, payload: Dict[str, Any]) -> None:
+    """
+    Queue a payload for the archive worker – never blocks the request.
+    """
+    try:
+        app.state.archive_q.put_nowait(payload)
+    except asyncio.QueueFull:
+        logging.warning("Archive queue full, dropping payload")
+
+
+def _open_archive(day: str):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{day}.ndjson")
+    return open(path, "ab", buffering=ARCHIVE_BUFFER_SIZE)
+
+
+def _write_and_flush(fp, data: bytes) -> None:
+    fp.write(data)
+    fp.flush()
+
+
+async def _archive_worker(queue: asyncio.Queue) -> None:
+    """
+    Append queued payloads to a daily NDJSON file (plane_requests/YYYYMMDD.ndjson).
+
+    The file handle stays open between writes; it is flushed every
+    ARCHIVE_FLUSH_EVERY records or ARCHIVE_FLUSH_INTERVAL seconds, and
+    before the buffer would overflow. In-loop writes therefore only ever
+    copy into the buffer; anything touching the disk runs in a thread.
+    A failing record is logged and skipped rather than stopping the worker.
+    """
+    fp = None
+    day = None
+    pending = 0
+    pending_bytes = 0
+    last_flush = time.monotonic()
+    try:
+        while True:
+            try:
+                payload = await asyncio.wait_for(
+                    queue.get(), timeout=ARCHIVE_FLUSH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                payload = None  # nothing new, just check the flush timer
+            if payload is _ARCHIVE_STOP:
+                break
+
+            try:
+                if payload is not None:
+                    today = datetime.now(timezone.utc).strftime("%Y%m%d")
+                    if today != day:
+                        if fp:
+                            old, fp = fp, None
+                            await asyncio.to_thread(old.close)
+                        fp = await asyncio.to_thread(_open_archive, today)
+                        day = today
+                        pending = pending_bytes = 0
+                    line = orjson.dumps(payload) + b"\n"
+                    if len(line) > ARCHIVE_BUFFER_SIZE:
+                        # too big to buffer – write it out directly, off the loop
+                        await asyncio.to_thread(_write_and_flush, fp, line)
+                        pending = pending_bytes = 0
+                        last_flush = time.monotonic()
+                    else:
+                        if pending_bytes + len(line) > ARCHIVE_BUFFER_SIZE:
+                            await asyncio.to_thread(fp.flush)
+                            pending = pending_bytes = 0
+                            last_flush = time.monotonic()
+                        fp.write(line)  # fits in the buffer, no syscall
+                        pending += 1
+                        pending_bytes += len(line)
+
+                now = time.monotonic()
+                if pending and (
+                    pending >= ARCHIVE_FLUSH_EVERY
+                    or now - last_flush >= ARCHIVE_FLUSH_INTERVAL
+                ):
+                    await asyncio.to_thread(fp.flush)
+                    pending = pending_bytes = 0
+                    last_flush = now
+            except Exception as exc:
+                logging.error("Could not archive payload: %s", exc)
+    finally:
+        if fp:
+            await asyncio.to_thread(fp.close)
 
 
 # --------------------------------------------------------------------------- #
@@ -81,14 +290,41 @@ EVENT_ICON = {
     "comment": "💬",
 }
 
-_URL_RE = re.compile(r"^(https?://|attachment://)", re.I)
-_UUID_RE = re.compile(
-    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.I
-)
+_URL_PREFIXES = ("http://", "https://", "attachment://")
+_HEX_CHARS = frozenset("0123456789abcdefABCDEF")
 
 
 def _is_valid_url(url: str | None) -> bool:
-    return bool(url and isinstance(url, str) and _URL_RE.match(url))
+    if not url or not isinstance(url, str):
+        return False
+    # fast path: Plane sends lowercase schemes; only case-fold the prefix otherwise
+    return url.startswith(_URL_PREFIXES) or url[:13].lower().startswith(_URL_PREFIXES)
+
+
+def _is_uuid(s: str) -> bool:
+    """
+    Structural 8-4-4-4-12 hex check – cheaper than a regex on the hot path.
+    """
+    return (
+        len(s) == 36
+        and s[8] == "-"
+        and s[13] == "-"
+        and s[18] == "-"
+        and s[23] == "-"
+        and s.count("-") == 4
+        and _HEX_CHARS.issuperset(s.replace("-", ""))
+    )
+
+
+def _sanitize_scalar(value: Any) -> str:
+    """
+    _sanitize_value for non-container values.
+    """
+    if value is None or value == "":
+        return "—"
+    if type(value) is str:
+        return "—" if _is_uuid(value) else value
+    return str(value)
 
 
 def _sanitize_value(value: Any) -> str:
@@ -98,11 +334,23 @@ def _sanitize_value(value: Any) -> str:
     if value in (None, "", [], {}):
         return "—"
 
-    if isinstance(value, list):
-        pretty = [_sanitize_value(v) for v in value]
-        return ", ".join(p for p in pretty if p != "—") or "—"
-
-    if isinstance(value, dict):
+    # payloads come from JSON, so exact type checks are enough (and cheaper)
+    t = type(value)
+
+    if t is list:
+        # single pass: sanitize and drop empty entries while joining
+        return ", ".join(
+            s
+            for v in value
+            if (
+                s := _sanitize_value(v)
+                if type(v) in (list, dict)
+                else _sanitize_scalar(v)
+            )
+            != "—"
+        ) or "—"
+
+    if t is dict:
         # try common name keys
         for k in ("display_name", "name", "title"):
             if k in value and value[k]:
@@ -110,14 +358,50 @@ def _sanitize_value(value: Any) -> str:
         # fall back to str(dict) – should be fine, callers rarely pass dicts
         return str(value)
 
-    if isinstance(value, str) and _UUID_RE.match(value):
-        return "—"
+    return _sanitize_scalar(value)
 
-    return str(value)
+
+_ts_cache: Tuple[int, str] = (0, "")
+
+
+def _now_iso() -> str:
+    """
+    Current UTC time as ISO string, second granularity, formatted once per second.
+    """
+    global _ts_cache
+    sec = int(time.time())
+    if sec != _ts_cache[0]:
+        _ts_cache = (sec, datetime.fromtimestamp(sec, timezone.utc).isoformat())
+    return _ts_cache[1]
+
+
+# Discord rejects the whole message if any embed exceeds these
+EMBED_TITLE_LIMIT = 256
+EMBED_FIELD_NAME_LIMIT = 256
+EMBED_FIELD_VALUE_LIMIT = 1024
+EMBED_AUTHOR_LIMIT = 256
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _field_value(value: Any) -> str:
+    return _clip(_sanitize_value(value), EMBED_FIELD_VALUE_LIMIT)
 
 
 def _make_field(name: str, value: Any, inline: bool = True) -> Dict[str, Any]:
-    return {"name": name, "value": _sanitize_value(value), "inline": inline}
+    return {
+        "name": _clip(name, EMBED_FIELD_NAME_LIMIT),
+        "value": _field_value(value),
+        "inline": inline,
+    }
+
+
+# templates for the fields every embed starts with
+_EVENT_FIELD = {"name": "Event", "inline": True}
+_ACTION_FIELD = {"name": "Action", "inline": True}
+_BY_FIELD = {"name": "By", "inline": True}
 
 
 def _arrow_change(old: Any, new: Any) -> str:
@@ -127,16 +411,15 @@ def _arrow_change(old: Any, new: Any) -> str:
     return f"{_sanitize_value(old)} ➜ {_sanitize_value(new)}"
 
 
-def build_discord_embed(
-    p: PlaneWebhook, author_icon_url: Optional[str] = None
-) -> Optional[Dict[str, Any]]:
+def build_discord_embed(p: PlaneWebhook) -> Optional[Dict[str, Any]]:
     """
     Create a Discord embed that is focused on *human readable* information.
 
     • Never show raw IDs or UUIDs
     • Represent changes with arrows, e.g.  “Backlog ➜ Todo”
     """
-    action = p.action.lower()
+    # Plane actions are normally lowercase already – skip the copy then
+    action = p.action if p.action.islower() else p.action.lower()
     color = ACTION_COLOR.get(action, 0x3498DB)  # default blue
     icon = EVENT_ICON.get(p.event, "ℹ️")
 
@@ -146,9 +429,9 @@ def build_discord_embed(
 
     # ---------- common fields ----------
     fields: List[Dict[str, Any]] = [
-        _make_field("Event", p.event.capitalize()),
-        _make_field("Action", p.action.capitalize()),
-        _make_field("By", actor_name),
+        dict(_EVENT_FIELD, value=_field_value(p.event.capitalize())),
+        dict(_ACTION_FIELD, value=_field_value(p.action.capitalize())),
+        dict(_BY_FIELD, value=_field_value(actor_name)),
     ]
 
     # ---------- event specifics ----------
@@ -184,10 +467,10 @@ def build_discord_embed(
         )
 
     embed: Dict[str, Any] = {
-        "title": f"{icon}  {title}",
+        "title": _clip(f"{icon}  {title}", EMBED_TITLE_LIMIT),
         "color": color,
         "fields": fields,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": _now_iso(),
     }
 
     # ---------- optional visuals ----------
@@ -195,10 +478,7 @@ def build_discord_embed(
     if _is_valid_url(thumb):
         embed["thumbnail"] = {"url": thumb}
 
-    if author_icon_url:
-        embed["author"] = {"name": actor_name, "icon_url": author_icon_url}
-    else:
-        embed["author"] = {"name": actor_name}
+    embed["author"] = {"name": _clip(actor_name or "Unknown", EMBED_AUTHOR_LIMIT)}
 
     return embed
 
@@ -206,32 +486,105 @@ def build_discord_embed(
 # --------------------------------------------------------------------------- #
 #  Avatar‑helpers
 # --------------------------------------------------------------------------- #
-async def _download_avatar(avatar_path: str) -> Optional[Tuple[bytes, str, str]]:
+AVATAR_CACHE_BYTES = 32 * 1024 * 1024  # total avatar bytes kept in memory
+AVATAR_CACHE_TTL = 3600  # seconds
+AVATAR_WAIT_TIMEOUT = 3.0  # seconds a queued message waits for its avatar
+AVATAR_MAX_BYTES = 1024 * 1024  # larger avatars are skipped
+
+_MIME_EXT = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/svg+xml": ".svg",
+}
+
+# avatar_path → (bytes, filename, mime); avatars change rarely
+_AVATAR_CACHE: TTLCache = TTLCache(
+    maxsize=AVATAR_CACHE_BYTES, ttl=AVATAR_CACHE_TTL, getsizeof=lambda v: len(v[0])
+)
+# avatar_path → event set once an in-flight download finishes
+_AVATAR_INFLIGHT: Dict[str, asyncio.Event] = {}
+# strong refs to downloads that outlive a timed-out webhook (asyncio keeps weak ones)
+_AVATAR_TASKS: set = set()
+
+
+async def _download_avatar(
+    client: httpx.AsyncClient, avatar_path: str
+) -> Optional[Tuple[bytes, str, str]]:
+    """
+    Cached wrapper around _fetch_avatar.
+
+    Concurrent misses for the same avatar share a single download.
+    Failures are not cached.
+    """
+    if not avatar_path:
+        return None
+
+    cached = _AVATAR_CACHE.get(avatar_path)
+    if cached:
+        return cached
+
+    inflight = _AVATAR_INFLIGHT.get(avatar_path)
+    if inflight:
+        await inflight.wait()
+        return _AVATAR_CACHE.get(avatar_path)
+
+    done = _AVATAR_INFLIGHT[avatar_path] = asyncio.Event()
+    try:
+        result = await _fetch_avatar(client, avatar_path)
+        if result:
+            _AVATAR_CACHE[avatar_path] = result
+        return result
+    finally:
+        del _AVATAR_INFLIGHT[avatar_path]
+        done.set()
+
+
+async def _read_capped(r: httpx.Response, limit: int) -> bytes:
+    """
+    Read a streamed body chunk by chunk, bailing out once it exceeds *limit*.
+    """
+    length = r.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > limit:
+        raise ValueError(f"body too large ({length} bytes)")
+    buf = bytearray()
+    async for chunk in r.aiter_bytes():
+        buf += chunk
+        if len(buf) > limit:
+            raise ValueError(f"body larger than {limit} bytes")
+    return bytes(buf)
+
+
+async def _fetch_avatar(
+    client: httpx.AsyncClient, avatar_path: str
+) -> Optional[Tuple[bytes, str, str]]:
     """
     Return (bytes, filename, mime) or None on failure.
 
     • If avatar_path is already an absolute URL → use it.
     • Otherwise prepend PLANE_BASE_URL.
     • If PLANE_API_TOKEN is set → send Bearer token (only on original URL).
+    • The body is streamed and capped at AVATAR_MAX_BYTES.
     """
-    if not avatar_path:
-        return None
-
     if _is_valid_url(avatar_path):
         url = avatar_path
     else:
         if not PLANE_BASE_URL:
             return None
-        url = urljoin(PLANE_BASE_URL + "/", avatar_path.lstrip("/"))
+        # PLANE_BASE_URL has no trailing slash, so plain concatenation suffices
+        url = f"{PLANE_BASE_URL}/{avatar_path.lstrip('/')}"
 
     headers = {}
     if PLANE_API_TOKEN:
         headers["Authorization"] = f"Bearer {PLANE_API_TOKEN}"
 
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            # First request without following redirects automatically.
-            r = await client.get(url, headers=headers, follow_redirects=False)
+        # First request without following redirects automatically.
+        r = await client.send(
+            client.build_request("GET", url, headers=headers), stream=True
+        )
+        try:
             # If a redirect is issued (e.g. 302), try to follow it manually.
             if r.status_code in (301, 302, 303, 307, 308):
                 redirect_url = r.headers.get("Location")
@@ -240,76 +593,315 @@ async def _download_avatar(avatar_path: str) -> Optional[Tuple[bytes, str, str]]
                     # Remove the Authorization header on the redirect request.
                     new_headers = headers.copy()
                     new_headers.pop("Authorization", None)
-                    r = await client.get(
-                        redirect_url, headers=new_headers, follow_redirects=False
+                    await r.aclose()
+                    r = await client.send(
+                        client.build_request("GET", redirect_url, headers=new_headers),
+                        stream=True,
                     )
             r.raise_for_status()
-            content_type = r.headers.get("Content-Type", "").lower()
-            # Guess extension from Content‑Type header; default to png.
-            ext = mimetypes.guess_extension(content_type.split(";")[0]) or ".png"
-            mime = content_type.split(";")[0] or "image/png"
+            content_type = r.headers.get("Content-Type", "").lower().split(";")[0].strip()
+            # Map Content‑Type header to an extension; default to png.
+            ext = _MIME_EXT.get(content_type, ".png")
+            mime = content_type or "image/png"
             filename = f"avatar{ext}"
-            return r.content, filename, mime
+            return await _read_capped(r, AVATAR_MAX_BYTES), filename, mime
+        finally:
+            await r.aclose()
     except Exception as exc:
         logging.warning("Could not fetch avatar from %s: %s", url, exc)
         return None
 
 
 # --------------------------------------------------------------------------- #
-#  Endpoint
+#  Discord delivery – background worker with rate-limit handling
 # --------------------------------------------------------------------------- #
-@app.post("/plane-webhook", response_model=dict[str, str])
-async def handle_plane_webhook(payload: PlaneWebhook, request: Request) -> dict[str, str]:
-    # Archive for debugging
-    raw_json = await request.json()
-    # save_plane_request(raw_json)
+DISCORD_QUEUE_SIZE = 1000
+DISCORD_MAX_RETRIES = 5
+DISCORD_SHUTDOWN_TIMEOUT = 10.0  # seconds to deliver the backlog on shutdown
+DISCORD_MAX_BATCH = 10          # embeds per message (Discord limit)
+DISCORD_MAX_BATCH_CHARS = 6000  # total embed text per message (Discord limit)
+DISCORD_MAX_DELAY = 0.1         # seconds to wait for more embeds to batch
+_DISCORD_STOP = object()
+
+# static part of every message – shared, never mutated
+_DISCORD_BASE: Dict[str, Any] = {
+    "allowed_mentions": {"parse": []},  # avoid accidental pings
+}
 
-    avatar_job: Optional[Tuple[bytes, str, str]] = None
-    if payload.activity and payload.activity.actor and payload.activity.actor.avatar_url:
-        avatar_job = await _download_avatar(payload.activity.actor.avatar_url)
 
-    # Build embed (use attachment:// if we have an avatar to upload)
-    author_icon = f"attachment://{avatar_job[1]}" if avatar_job else None
-    embed = build_discord_embed(payload, author_icon_url=author_icon)
+async def _post_to_discord(
+    client: httpx.AsyncClient,
+    discord_payload: Dict[str, Any],
+    avatar_job: Optional[Tuple[bytes, str, str]],
+) -> httpx.Response:
+    if avatar_job:
+        avatar_bytes, filename, mime = avatar_job
+        files = {
+            "payload_json": (
+                None,
+                orjson.dumps(discord_payload),
+                "application/json",
+            ),
+            "files[0]": (filename, avatar_bytes, mime),
+        }
+        return await client.post(DISCORD_WEBHOOK_URL, files=files)
+    return await client.post(
+        DISCORD_WEBHOOK_URL,
+        content=orjson.dumps(discord_payload),
+        headers={"Content-Type": "application/json"},
+    )
 
-    if not embed:
-        logging.info("No relevant changes to report for event: %s", payload.event)
-        return {"status": "No relevant changes to report to discord"}
 
-    discord_payload = {
-        "embeds": [embed],
-        "allowed_mentions": {"parse": []},  # avoid accidental pings
-    }
+def _retry_after(resp: httpx.Response) -> float:
+    """
+    Seconds to wait after a 429, from the Retry-After header or the JSON body.
+    """
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return float(resp.json()["retry_after"])
+    except Exception:
+        return 1.0
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        if avatar_job:
-            avatar_bytes, filename, mime = avatar_job
-            files = {
-                "payload_json": (
-                    None,
-                    json.dumps(discord_payload),
-                    "application/json",
-                ),
-                "files[0]": (filename, avatar_bytes, mime),
-            }
-            resp = await client.post(DISCORD_WEBHOOK_URL, files=files)
+
+async def _send_to_discord(
+    client: httpx.AsyncClient,
+    embeds: List[Dict[str, Any]],
+    avatar_job: Optional[Tuple[bytes, str, str]],
+) -> Optional[int]:
+    """
+    Post one message with up to DISCORD_MAX_BATCH embeds, retrying on 429
+    (honouring Retry-After), 5xx and transport errors with exponential backoff.
+
+    Returns the last HTTP status seen, or None if Discord was never reached.
+    """
+    discord_payload = dict(_DISCORD_BASE, embeds=embeds)
+    status: Optional[int] = None
+
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        try:
+            resp = await _post_to_discord(client, discord_payload, avatar_job)
+        except httpx.HTTPError as exc:
+            logging.warning("Discord webhook request failed: %s", exc)
+            delay = 2.0 ** attempt
         else:
-            resp = await client.post(DISCORD_WEBHOOK_URL, json=discord_payload)
+            status = resp.status_code
+            # Discord returns 204 on success but some cases it may return 200,
+            # so we consider both as success
+            if resp.status_code in (200, 204):
+                return status
+            try:
+                err_info = resp.json()
+            except Exception:
+                err_info = resp.text
+            if resp.status_code == 429:
+                delay = _retry_after(resp)
+                logging.warning("Discord rate limited, retrying in %.2fs", delay)
+            elif resp.status_code >= 500:
+                delay = 2.0 ** attempt
+                logging.warning(
+                    "Discord webhook failed (%s): %s", resp.status_code, err_info
+                )
+            else:
+                logging.error(
+                    "Discord webhook failed (%s): %s", resp.status_code, err_info
+                )
+                return status
+        if attempt < DISCORD_MAX_RETRIES:
+            await asyncio.sleep(delay)
+
+    logging.error("Giving up on Discord message after %d retries", DISCORD_MAX_RETRIES)
+    return status
+
+
+def _embed_chars(embed: Dict[str, Any]) -> int:
+    """
+    Text length Discord counts towards its per-message embed limit.
+    """
+    return (
+        len(embed.get("title") or "")
+        + len((embed.get("author") or {}).get("name") or "")
+        + sum(
+            len(f.get("name") or "") + len(f.get("value") or "")
+            for f in embed.get("fields") or ()
+        )
+    )
+
+
+async def _resolve_avatar(
+    item: Tuple[Dict[str, Any], Optional[asyncio.Task], float]
+) -> Tuple[Dict[str, Any], Optional[Tuple[bytes, str, str]]]:
+    """
+    Turn a queued (embed, avatar_task, deadline) item into (embed, avatar_job).
 
-    # Discord returns 204 on success but some cases it may return 200,
-    # so we consider both as success
-    if resp.status_code not in (200, 204):
+    Waits for the avatar download until *deadline* at most; the download is
+    shielded so a late one still finishes and warms the cache.
+    """
+    embed, avatar_task, deadline = item
+    avatar_job = None
+    if avatar_task and not avatar_task.cancelled():
+        timeout = max(0.0, deadline - asyncio.get_running_loop().time())
         try:
-            err_info = resp.json()
-        except Exception:
-            err_info = resp.text
-        logging.error("Discord webhook failed (%s): %s", resp.status_code, err_info)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Discord webhook failed ({resp.status_code}): {err_info}",
+            avatar_job = await asyncio.wait_for(
+                asyncio.shield(avatar_task), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logging.warning("Avatar download timed out, sending without it")
+    # use attachment:// if we have an avatar to upload
+    if avatar_job:
+        embed["author"]["icon_url"] = f"attachment://{avatar_job[1]}"
+    return embed, avatar_job
+
+
+async def _discord_worker(client: httpx.AsyncClient, queue: asyncio.Queue) -> None:
+    """
+    Deliver queued (embed, avatar_task, deadline) items to Discord.
+
+    Embeds without an avatar attachment are coalesced: after the first one
+    arrives we wait up to DISCORD_MAX_DELAY for more and send up to
+    DISCORD_MAX_BATCH of them in a single POST. Items carrying an avatar
+    need their own multipart request and are sent alone.
+    """
+    loop = asyncio.get_running_loop()
+    carry = None  # resolved item that did not fit into the previous batch
+    resolving = None  # dequeued item whose avatar we are waiting for
+    embeds: List[Dict[str, Any]] = []  # taken off the queue but not delivered yet
+    stopping = False
+
+    try:
+        while not stopping:
+            if carry is not None:
+                item, carry = carry, None
+            else:
+                item = await queue.get()
+                if item is _DISCORD_STOP:
+                    break
+                resolving = item
+
+            # one bad item must never take the worker down
+            try:
+                if resolving is not None:
+                    item = await _resolve_avatar(resolving)
+                    resolving = None
+                embed, avatar_job = item
+                embeds = [embed]
+                if not avatar_job:
+                    chars = _embed_chars(embed)
+                    deadline = loop.time() + DISCORD_MAX_DELAY
+                    while len(embeds) < DISCORD_MAX_BATCH:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            nxt = await asyncio.wait_for(queue.get(), timeout=timeout)
+                        except asyncio.TimeoutError:
+                            break
+                        if nxt is _DISCORD_STOP:
+                            stopping = True
+                            break
+                        resolving = nxt
+                        nxt = await _resolve_avatar(nxt)
+                        resolving = None
+                        if (
+                            nxt[1]
+                            or chars + _embed_chars(nxt[0]) > DISCORD_MAX_BATCH_CHARS
+                        ):
+                            carry = nxt
+                            break
+                        embeds.append(nxt[0])
+                        chars += _embed_chars(nxt[0])
+
+                status = await _send_to_discord(client, embeds, avatar_job)
+                if (
+                    len(embeds) > 1
+                    and status is not None
+                    and 400 <= status < 500
+                    and status != 429
+                ):
+                    # Discord rejects a message as a whole – resend one by one so a
+                    # single bad embed doesn't take the rest of the batch with it
+                    logging.warning(
+                        "Discord rejected a batch of %d embeds, resending individually",
+                        len(embeds),
+                    )
+                    while embeds:
+                        await _send_to_discord(client, [embeds[0]], None)
+                        embeds.pop(0)
+            except Exception as exc:
+                logging.error("Discord worker failed to deliver message: %s", exc)
+            embeds = []
+            resolving = None
+    except asyncio.CancelledError:
+        # shutdown deadline hit – report what was dequeued but never delivered
+        inflight = len(embeds) + (carry is not None) + (resolving is not None)
+        if inflight:
+            logging.warning(
+                "Discord worker cancelled, dropped %d in-flight message(s)", inflight
+            )
+        raise
+
+
+# --------------------------------------------------------------------------- #
+#  Endpoint
+# --------------------------------------------------------------------------- #
+@app.post("/plane-webhook", openapi_extra=_PLANE_WEBHOOK_OPENAPI)
+async def handle_plane_webhook(request: Request) -> dict[str, str]:
+    # Decode the body once and validate the already-parsed dict.
+    # Errors are shaped like FastAPI's own body validation (422, loc "body").
+    try:
+        raw_json = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as exc:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "json_invalid",
+                    "loc": ("body", exc.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": exc.msg},
+                }
+            ],
+            body=exc.doc,
+        ) from exc
+    try:
+        payload = PlaneWebhook.model_validate(raw_json)
+    except ValidationError as exc:
+        errors = [{**err, "loc": ("body", *err["loc"])} for err in exc.errors()]
+        raise RequestValidationError(errors, body=raw_json) from exc
+
+    # Archive for debugging (queued, written by the archive worker)
+    if ARCHIVE_ENABLED:
+        save_plane_request(request.app, raw_json)
+
+    embed = build_discord_embed(payload)
+
+    if not embed:
+        logging.info("No relevant changes to report for event: %s", payload.event)
+        return {"status": "No relevant changes to report to discord"}
+
+    # Start the avatar download now; the Discord worker waits for it (bounded),
+    # so Plane gets its ACK without waiting on the avatar
+    avatar_task: Optional[asyncio.Task] = None
+    if payload.activity and payload.activity.actor and payload.activity.actor.avatar_url:
+        avatar_task = asyncio.create_task(
+            _download_avatar(
+                request.app.state.plane_client, payload.activity.actor.avatar_url
+            )
         )
+        _AVATAR_TASKS.add(avatar_task)
+        avatar_task.add_done_callback(_AVATAR_TASKS.discard)
+    avatar_deadline = asyncio.get_running_loop().time() + AVATAR_WAIT_TIMEOUT
+
+    # ACK Plane right away; the Discord worker delivers (and retries) later
+    try:
+        request.app.state.discord_q.put_nowait((embed, avatar_task, avatar_deadline))
+    except asyncio.QueueFull:
+        logging.error("Discord queue full, rejecting webhook for event: %s", payload.event)
+        raise HTTPException(status_code=503, detail="Discord queue is full")
 
-    return {"status": "Message forwarded to Discord successfully"}
+    return {"status": "Message queued for Discord"}
 
 
 # --------------------------------------------------------------------------- #
@@ -320,4 +912,13 @@ if __name__ == "__main__":
 
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host=host, port=port)
+    workers = int(os.getenv("WORKERS", 1))
+    uvicorn.run(
+        # uvicorn needs an import string to spawn multiple workers
+        "main:app" if workers > 1 else app,
+        host=host,
+        port=port,
+        workers=workers,
+        limit_concurrency=1000,
+        backlog=2048,
+    )